@@ -1,49 +1,1109 @@
+import os
+import re
+import contextlib
+import fcntl
+import json
+import hashlib
+import glob
+import itertools
+import shutil
+import tempfile
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import joblib
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import streamlit as st
 import plotly.express as px
 from datetime import timedelta
 from mlxtend.frequent_patterns import apriori, association_rules, fpgrowth
+from forecasting import MODELS, decompose, fitted_model, forecast
+from clustering import FEATURES, assign, fit_model, sample_rows, sweep_point
 
 # Page config
 st.set_page_config(page_title="Market Basket Analysis", layout="wide", page_icon="📊")
 st.title("📊 Business Insights Analysis Dashboard")
 st.markdown("An interactive dashboard for Market Basket & Sales Analysis")
 
-# Load and clean data
-@st.cache_data
-def load_data():
-    df = pd.read_csv("OnlineRetail.csv", encoding='ISO-8859-1')
+DATA_PATH = "OnlineRetail.csv"
+INCOMING_DIR = os.environ.get("RETAIL_INCOMING", "incoming")
+FORECAST_WORKERS = int(os.environ.get("RETAIL_FORECAST_WORKERS", "0"))
+SWEEP_WORKERS = int(os.environ.get("RETAIL_SWEEP_WORKERS", "2"))
+CATEGORIES_PATH = os.environ.get("RETAIL_CATEGORIES", "categories.json")
+CACHE_DIR = ".cache"
+CHUNK_MB = int(os.environ.get("RETAIL_CHUNK_MB", "256"))
+# "pandas" (read_csv + inferred dates) or "arrow" (multithreaded Arrow reader with a fixed date format)
+INGEST_ENGINE = os.environ.get("RETAIL_ENGINE", "pandas")
+DATE_FORMAT = os.environ.get("RETAIL_DATE_FORMAT", "%m/%d/%Y %H:%M")
+CSV_DTYPES = {"InvoiceNo": "str", "StockCode": "str", "Description": "str", "Quantity": "int64",
+              "UnitPrice": "float64", "CustomerID": "float64", "Country": "str"}
+ARROW_TYPES = {"InvoiceNo": pa.string(), "StockCode": pa.string(), "Description": pa.string(), "Quantity": pa.int64(),
+               "InvoiceDate": pa.timestamp("us"), "UnitPrice": pa.float64(), "CustomerID": pa.float64(), "Country": pa.string()}
+# Compact in-memory schema: categorical text columns, 32-bit ids and quantities, float32 prices,
+# microsecond timestamps whichever engine parsed them.
+# Revenue stays float64 so that sums over the full history keep their precision.
+SCHEMA = {"InvoiceNo": "int32", "StockCode": "category", "Description": "category", "Quantity": "int32",
+          "InvoiceDate": "datetime64[us]", "UnitPrice": "float32", "CustomerID": "int32", "Country": "category",
+          "Line": "int32"}
+# A transaction line is identified by its invoice, product and position within the invoice
+LINE_KEY = ["InvoiceNo", "StockCode", "Line"]
+
+# Write JSON through a temporary file and a rename, so readers never see a half-written file
+def write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+# Exclusive lock on the cache for ingestion, appends and shared-file writes, which sessions (threads) and
+# server processes would otherwise run concurrently on the same directories. Each holder takes a flock on
+# its own open file, which the OS releases when the holder exits, so a crashed process never leaves it held.
+@contextlib.contextmanager
+def cache_lock():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, "lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def read_stamps():
+    try:
+        with open(os.path.join(CACHE_DIR, "sources.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Fingerprint of a CSV file; the content hash is only recomputed when size or mtime change. Callers
+# fingerprinting many files pass the stamps read once with read_stamps, which are updated in place.
+def source_key(path, stamps=None):
+    stat = os.stat(path)
+    stamps = read_stamps() if stamps is None else stamps
+    stamp = stamps.get(os.path.abspath(path), {})
+    if stamp.get("size") == stat.st_size and stamp.get("mtime") == stat.st_mtime_ns:
+        return stamp["key"]
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    key = f"{stat.st_size}-{digest.hexdigest()}"
+    stamps[os.path.abspath(path)] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "key": key}
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    write_json(os.path.join(CACHE_DIR, "sources.json"), stamps)
+    return key
+
+def clean_data(df):
     df = df.dropna(subset=["CustomerID"])
     df = df[~df['InvoiceNo'].astype(str).str.startswith('C')]
     df = df[df['Quantity'] > 0]
     df['InvoiceDate'] = pd.to_datetime(df['InvoiceDate'])
     df['Revenue'] = df['Quantity'] * df['UnitPrice']
-    return df
+    return df.astype(SCHEMA).reset_index(drop=True)
+
+# Per-column memory of the frame as parsed from CSV versus the compact SCHEMA
+def memory_report(df):
+    before = df.astype(CSV_DTYPES).memory_usage(deep=True, index=False) / 2**20
+    after = df.memory_usage(deep=True, index=False) / 2**20
+    report = pd.DataFrame({"Before (MB)": before, "After (MB)": after})
+    report.loc["Total"] = report.sum()
+    report["Reduction"] = report["Before (MB)"] / report["After (MB)"]
+    return report
+
+# Rows per chunk so that one parsed chunk stays within chunk_mb of memory, estimated from a sample
+def chunk_rows(path, chunk_mb=CHUNK_MB):
+    sample = pd.read_csv(path, encoding='ISO-8859-1', dtype=CSV_DTYPES, nrows=10000)
+    bytes_per_row = max(sample.memory_usage(deep=True).sum() / max(len(sample), 1), 1)
+    return max(int(chunk_mb * 2**20 / bytes_per_row), 1000)
+
+# Raw CSV chunks of about chunk_mb once parsed, from pandas or from the Arrow streaming reader
+def csv_chunks(path, chunk_mb=CHUNK_MB, engine=INGEST_ENGINE):
+    rows = chunk_rows(path, chunk_mb)
+    if engine == "pandas":
+        yield from pd.read_csv(path, encoding='ISO-8859-1', dtype=CSV_DTYPES, chunksize=rows)
+        return
+    with open(path, "rb") as f:
+        f.readline()
+        sample = f.read(1 << 20)
+    raw_bytes_per_row = len(sample) / max(sample.count(b"\n"), 1)
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(encoding="latin1", use_threads=True,
+                                        block_size=int(min(rows * raw_bytes_per_row, 2**30))),
+        convert_options=pa_csv.ConvertOptions(column_types=ARROW_TYPES, timestamp_parsers=[DATE_FORMAT]))
+    for batch in reader:
+        yield batch.to_pandas()
+
+# Read a CSV in chunks, numbering each row by its position within its invoice (Line).
+# Invoice lines are contiguous in the export, so an invoice split across chunks continues its numbering.
+def read_chunks(path, chunk_mb=CHUNK_MB, engine=INGEST_ENGINE):
+    last_invoice, last_lines = None, 0
+    for chunk in csv_chunks(path, chunk_mb, engine):
+        if chunk.empty:
+            continue
+        carried = np.where(chunk['InvoiceNo'] == last_invoice, last_lines, 0)
+        chunk['Line'] = chunk.groupby('InvoiceNo', sort=False).cumcount() + carried
+        last_invoice, last_lines = chunk['InvoiceNo'].iloc[-1], int(chunk['Line'].iloc[-1]) + 1
+        yield chunk
+
+# Seconds to read and clean the first fraction of a CSV's rows with each ingestion engine;
+# the samples are copied line by line so the source file is never held in memory
+def benchmark_engines(path, fractions=(0.25, 0.5, 1.0), engines=("pandas", "arrow")):
+    with open(path, "rb") as f:
+        f.readline()
+        total = sum(1 for _ in f)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for fraction in fractions:
+            rows = int(total * fraction)
+            sample_path = os.path.join(tmp, f"sample-{fraction}.csv")
+            with open(path, "rb") as src, open(sample_path, "wb") as f:
+                f.write(src.readline())
+                f.writelines(itertools.islice(src, rows))
+            for engine in engines:
+                t0 = time.perf_counter()
+                n = sum(len(clean_data(chunk)) for chunk in read_chunks(sample_path, engine=engine))
+                results.append({"Rows": rows, "Engine": engine,
+                                "Seconds": time.perf_counter() - t0, "Clean rows": n})
+    return pd.DataFrame(results)
+
+def month_of(df):
+    return df['InvoiceDate'].dt.strftime("%Y-%m")
+
+# Aggregate cube for one month partition at grain date x product x country x customer.
+# Invoices counts the distinct invoices in a cell and is only additive across dates, countries and customers.
+# Orders credits each invoice to the cell of its first line, so it sums to exact order counts in any rollup.
+def cube_aggregate(part):
+    part = part.assign(Date=part['InvoiceDate'].dt.normalize(), Orders=(~part['InvoiceNo'].duplicated()).astype("int32"))
+    return (part.groupby(["Date", "Description", "Country", "CustomerID"], observed=True)
+                .agg(Quantity=("Quantity", "sum"), Revenue=("Revenue", "sum"), Lines=("Revenue", "size"),
+                     Invoices=("InvoiceNo", "nunique"), Orders=("Orders", "sum"))
+                .reset_index())
+
+# Written through a dot-prefixed temporary file, which the Parquet dataset reader skips, and a rename
+def write_cube(cache_path, month):
+    os.makedirs(os.path.join(cache_path, "_cube"), exist_ok=True)
+    tmp = os.path.join(cache_path, "_cube", f".{month}.parquet.tmp")
+    cube_aggregate(pd.read_parquet(os.path.join(cache_path, month))).to_parquet(tmp, index=False)
+    os.replace(tmp, os.path.join(cache_path, "_cube", f"{month}.parquet"))
+
+# Out-of-core ingestion: stream the CSV in bounded chunks and write the cleaned rows of each chunk
+# into month partitions (out_dir/YYYY-MM/part-NNNNN.parquet), then the per-month aggregate cube
+def ingest_chunked(path, out_dir, chunk_mb=CHUNK_MB):
+    os.makedirs(out_dir, exist_ok=True)
+    for i, chunk in enumerate(read_chunks(path, chunk_mb)):
+        chunk = clean_data(chunk)
+        for month, part in chunk.groupby(month_of(chunk)):
+            os.makedirs(os.path.join(out_dir, month), exist_ok=True)
+            part.to_parquet(os.path.join(out_dir, month, f"part-{i:05d}.parquet"), index=False)
+    for month in dataset_months(out_dir):
+        write_cube(out_dir, month)
+
+# Incremental append of a daily drop: clean only the new file, merge it into the month partitions it
+# touches (de-duplicated on LINE_KEY so re-delivered rows are not counted twice) and refresh their aggregates
+def append_file(cache_path, path):
+    new = clean_data(pd.concat(read_chunks(path), ignore_index=True))
+    for month, part in new.groupby(month_of(new)):
+        month_path = os.path.join(cache_path, month)
+        merged = pd.concat([pd.read_parquet(month_path), part] if os.path.isdir(month_path) else [part], ignore_index=True)
+        merged = merged.drop_duplicates(LINE_KEY, keep="last").astype(SCHEMA)
+        shutil.rmtree(month_path + ".tmp", ignore_errors=True)
+        os.makedirs(month_path + ".tmp")
+        merged.to_parquet(os.path.join(month_path + ".tmp", "part-00000.parquet"), index=False)
+        # the old partition is moved aside, not deleted, until the merged one is in place
+        if os.path.isdir(month_path):
+            os.replace(month_path, month_path + ".old")
+        os.replace(month_path + ".tmp", month_path)
+        shutil.rmtree(month_path + ".old", ignore_errors=True)
+        write_cube(cache_path, month)
+
+# Undo an append interrupted between moving a month partition aside and swapping in its merged copy:
+# a month left only as YYYY-MM.old gets its old partition back, then leftover .old/.tmp copies are removed.
+# The interrupted file is still missing from the manifest, so it is merged again afterwards.
+def recover_months(cache_path):
+    for name in os.listdir(cache_path):
+        path = os.path.join(cache_path, name)
+        if name.endswith(".old") and not os.path.isdir(path[:-len(".old")]):
+            os.replace(path, path[:-len(".old")])
+        elif name.endswith((".old", ".tmp")):
+            shutil.rmtree(path, ignore_errors=True)
+
+def read_manifest(cache_path):
+    try:
+        with open(os.path.join(cache_path, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"appended": []}
+
+# Append every CSV in INCOMING_DIR that has not been merged yet and return the dataset version,
+# which changes whenever the base file or the set of appended files changes
+def sync_incoming(cache_path):
+    stamps = read_stamps()
+    files = [(path, source_key(path, stamps)) for path in sorted(glob.glob(os.path.join(INCOMING_DIR, "*.csv")))]
+    manifest = read_manifest(cache_path)
+    appended = set(manifest["appended"])
+    if any(file_key not in appended for _, file_key in files):
+        with cache_lock():
+            # another session may have appended the same files while this one waited for the lock
+            manifest = read_manifest(cache_path)
+            appended = set(manifest["appended"])
+            recover_months(cache_path)
+            for path, file_key in files:
+                if file_key not in appended:
+                    append_file(cache_path, path)
+                    manifest["appended"].append(file_key)
+                    appended.add(file_key)
+                    write_json(os.path.join(cache_path, "manifest.json"), manifest)
+    return hashlib.blake2b(" ".join([cache_path] + manifest["appended"]).encode(), digest_size=8).hexdigest()
+
+# Build the partitioned cache for a source fingerprint if it is missing and return its directory
+def build_cache(key):
+    cache_path = os.path.join(CACHE_DIR, f"OnlineRetail-{key}")
+    if not os.path.isdir(cache_path):
+        with cache_lock():
+            if not os.path.isdir(cache_path):
+                shutil.rmtree(cache_path + ".tmp", ignore_errors=True)
+                ingest_chunked(DATA_PATH, cache_path + ".tmp")
+                os.replace(cache_path + ".tmp", cache_path)
+                for name in os.listdir(CACHE_DIR):
+                    if name.startswith("OnlineRetail-") and name != os.path.basename(cache_path):
+                        shutil.rmtree(os.path.join(CACHE_DIR, name), ignore_errors=True)
+    return cache_path
+
+def dataset_months(cache_path):
+    return sorted(name for name in os.listdir(cache_path)
+                  if re.fullmatch(r"\d{4}-\d{2}", name) and os.path.isdir(os.path.join(cache_path, name)))
+
+# Layout of the shared store: column names, the sorted union of every categorical column's values across the
+# month partitions (each partition carries its own dictionaries) and the total row count. Only the categorical
+# columns of one month are read at a time; row counts come from the Parquet footers.
+def shared_layout(months):
+    schema = pq.read_schema(months[0][0])
+    names = [field.name for field in schema if pa.types.is_dictionary(field.type)]
+    values = {name: set() for name in names}
+    for files in months:
+        table = pq.read_table(files, columns=names)
+        for name in names:
+            for chunk in table[name].chunks:
+                values[name].update(chunk.dictionary.to_pylist())
+    n_rows = sum(pq.ParquetFile(f).metadata.num_rows for files in months for f in files)
+    return schema, {name: sorted(values[name]) for name in names}, n_rows
+
+# Smallest signed integer type that holds the codes of n categories, as pandas picks for categoricals
+def code_dtype(n):
+    return np.int8 if n < 2**7 else np.int16 if n < 2**15 else np.int32
+
+# Codes of a dictionary-encoded column against the shared, sorted category values
+def shared_codes(column, categories):
+    value_set = pa.array(categories, pa.string())
+    return np.concatenate([pc.take(pc.index_in(chunk.dictionary.cast(pa.string()), value_set=value_set),
+                                   chunk.indices).to_numpy() for chunk in column.chunks])
+
+# The full cleaned dataset, sorted by InvoiceDate, as one directory of uncompressed .npy column files per
+# dataset version. Sessions and worker processes memory-map it read-only, so the OS page cache holds a single
+# copy however many users there are, and a date window only touches the pages of its own contiguous row range.
+# The files are preallocated and filled one month partition at a time (months are already in time order), so
+# writing needs memory for a single month rather than the full history.
+def write_shared(cache_path, version):
+    shared_dir = os.path.join(cache_path, "_shared")
+    path = os.path.join(shared_dir, version)
+    if os.path.isdir(path):
+        return path
+    with cache_lock():
+        if not os.path.isdir(path):
+            months = [sorted(glob.glob(os.path.join(cache_path, month, "*.parquet"))) for month in dataset_months(cache_path)]
+            schema, dictionaries, n_rows = shared_layout(months)
+            shutil.rmtree(path + ".tmp", ignore_errors=True)
+            os.makedirs(path + ".tmp")
+            columns = {field.name: np.lib.format.open_memmap(
+                           os.path.join(path + ".tmp", f"{field.name}.npy"), mode="w+", shape=(n_rows,),
+                           dtype=code_dtype(len(dictionaries[field.name])) if field.name in dictionaries
+                           else field.type.to_pandas_dtype())
+                       for field in schema}
+            lo = 0
+            for files in months:
+                table = pq.read_table(files)
+                table = table.take(pc.sort_indices(table["InvoiceDate"]))
+                for name, out in columns.items():
+                    if name in dictionaries:
+                        out[lo:lo + len(table)] = shared_codes(table[name], dictionaries[name])
+                    else:
+                        out[lo:lo + len(table)] = table[name].to_numpy()
+                lo += len(table)
+            for out in columns.values():
+                out.flush()
+            del columns
+            write_json(os.path.join(path + ".tmp", "layout.json"),
+                       {"columns": schema.names, "dictionaries": dictionaries})
+            os.replace(path + ".tmp", path)
+            for name in os.listdir(shared_dir):
+                if os.path.isdir(os.path.join(shared_dir, name)) and name != version:
+                    shutil.rmtree(os.path.join(shared_dir, name), ignore_errors=True)
+                elif not os.path.isdir(os.path.join(shared_dir, name)):
+                    os.remove(os.path.join(shared_dir, name))
+    return path
+
+# Zero-copy view of a shared store: numeric and datetime columns point straight into the mappings,
+# categorical columns are rebuilt from their mapped codes
+def open_shared(path):
+    with open(os.path.join(path, "layout.json")) as f:
+        layout = json.load(f)
+    frame = {}
+    for name in layout["columns"]:
+        values = np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        if name in layout["dictionaries"]:
+            values = pd.Categorical.from_codes(values, categories=pd.Index(layout["dictionaries"][name]))
+        frame[name] = values
+    return pd.DataFrame(frame, copy=False)
+
+# One mapped frame per process, handed to every session without pickling or copying
+@st.cache_resource(max_entries=2)
+def load_shared(cache_path, version):
+    return open_shared(write_shared(cache_path, version))
+
+# Cube files of the months overlapping start..end (inclusive dates), or of every month, in time order
+def cube_files(cache_path, start=None, end=None):
+    lo = pd.Timestamp(start).strftime("%Y-%m") if start is not None else ""
+    hi = pd.Timestamp(end).strftime("%Y-%m") if end is not None else "9999-12"
+    return [os.path.join(cache_path, "_cube", f"{month}.parquet") for month in dataset_months(cache_path) if lo <= month <= hi]
+
+# The aggregate cube rows of a date window sorted by Date, read from the month files overlapping the window
+# only, so its load time and memory follow the window rather than the full history. Read under the cache lock
+# so an append in another process cannot leave it with months from two versions.
+@st.cache_resource(max_entries=4)
+def load_cube(cache_path, version, start, end):
+    with cache_lock():
+        # a window with no months still reads the first one so the date slice below returns a typed empty frame
+        cube = pd.read_parquet(cube_files(cache_path, start, end) or cube_files(cache_path)[:1])
+    cube = cube.sort_values("Date", kind="stable").reset_index(drop=True)
+    return cube.iloc[date_rows(cube['Date'].to_numpy(), start, end)].reset_index(drop=True)
+
+# Row positions of each category of a categorical column, ascending, so they stay in time order
+def row_index(column):
+    order = np.argsort(column.cat.codes.to_numpy(), kind="stable")
+    bounds = np.cumsum(np.bincount(column.cat.codes.to_numpy() + 1, minlength=len(column.cat.categories) + 1))
+    return dict(zip(column.cat.categories, np.split(order, bounds[:-1])[1:]))
+
+# Per-country row positions within the cube rows of a date window
+@st.cache_resource(max_entries=4)
+def load_cube_index(cache_path, version, start, end, _cube):
+    return row_index(_cube['Country'])
+
+# Per-country row positions within the line items of a date window, built from the window's slice only
+@st.cache_resource(max_entries=4)
+def load_country_index(cache_path, version, start, end, _window):
+    return row_index(_window['Country'])
+
+# Layout of the full-history cube, read without loading it: the sorted country and product labels across
+# every month file (from the Parquet dictionaries), the first day and the number of days
+def cube_layout(files):
+    _, dictionaries, _ = shared_layout([[path] for path in files])
+    first = pd.read_parquet(files[0], columns=["Date"])['Date'].min()
+    n_days = (pd.read_parquet(files[-1], columns=["Date"])['Date'].max() - first).days + 1
+    return {"Country": pd.Index(dictionaries["Country"]), "Description": pd.Index(dictionaries["Description"]),
+            "first": first, "n_days": n_days}
+
+# Codes of a categorical column against a fixed set of labels
+def label_codes(column, labels):
+    return labels.get_indexer(column.cat.categories)[column.cat.codes.to_numpy()]
 
-df = load_data()
+# Add the per-group day totals of one month of rows into daily (groups x days); the bincount only spans
+# the month's own days
+def add_daily(daily, codes, day, weights):
+    lo, hi = day.min(), day.max() + 1
+    sums = np.bincount(codes.astype(np.intp) * (hi - lo) + (day - lo), weights=weights,
+                       minlength=daily.shape[0] * (hi - lo))
+    daily[:, lo:hi] += sums.reshape(daily.shape[0], hi - lo).astype(daily.dtype)
+
+# Prefix sums over days of a (groups x days) array of day totals: out[g, d] is the total of group g before day d
+def prefix_sums(daily):
+    out = np.zeros((daily.shape[0], daily.shape[1] + 1), dtype=daily.dtype)
+    np.cumsum(daily, axis=1, out=out[:, 1:])
+    return out
+
+# Daily cumulative Revenue, Quantity and Orders globally, per country and per product, built once per
+# dataset version by streaming the cube one month file at a time, so only the (groups x days) results
+# scale with the full history. Product-level orders use Invoices (invoices containing the product).
+@st.cache_resource(max_entries=2)
+def load_prefix_index(cache_path, version):
+    with cache_lock():
+        files = cube_files(cache_path)
+        layout = cube_layout(files)
+        n_days = layout["n_days"]
+        levels = [("total", None, pd.Index(["All"]), "Orders"),
+                  ("country", "Country", layout["Country"], "Orders"),
+                  ("product", "Description", layout["Description"], "Invoices")]
+        # Revenue is summed in float64, quantities and order counts in int64
+        daily = {level: {measure: np.zeros((len(labels), n_days), dtype="float64" if measure == "Revenue" else "int64")
+                         for measure in MEASURES} for level, _, labels, _ in levels}
+        for path in files:
+            part = pd.read_parquet(path)
+            day = ((part['Date'] - layout["first"]) // pd.Timedelta(days=1)).to_numpy()
+            for level, column, labels, orders in levels:
+                codes = np.zeros(len(part), dtype=np.intp) if column is None else label_codes(part[column], labels)
+                for measure, weights in [("Revenue", "Revenue"), ("Quantity", "Quantity"), ("Orders", orders)]:
+                    add_daily(daily[level][measure], codes, day, part[weights].to_numpy())
+    index = {"first": layout["first"], "n_days": n_days}
+    for level, _, labels, _ in levels:
+        index[level] = {"labels": labels, **{measure: prefix_sums(daily[level][measure]) for measure in MEASURES}}
+    return index
+
+# Total of a measure between start and end (inclusive dates) for every group of a level, or only the
+# given groups, as one subtraction of two prefix-sum columns
+def range_total(index, level, measure, start, end, groups=None):
+    lo = int(np.clip((pd.Timestamp(start) - index["first"]).days, 0, index["n_days"]))
+    hi = int(np.clip((pd.Timestamp(end) - index["first"]).days + 1, 0, index["n_days"]))
+    sums = index[level][measure]
+    if groups is not None:
+        sums = sums[index[level]["labels"].get_indexer(list(groups))]
+    return pd.Series(sums[:, max(hi, lo)] - sums[:, lo], index=index[level]["labels"] if groups is None else list(groups))
+
+MEASURES = ["Revenue", "Quantity", "Orders"]
+GRANULARITIES = {"Hourly": None, "Daily": None, "Weekly": "W", "Monthly": "M", "Quarterly": "Q"}
+
+# Daily Revenue, Quantity and Orders per country over the full calendar, computed once per dataset version
+# as differences of the prefix-sum index
+@st.cache_resource(max_entries=2)
+def load_series(cache_path, version, _prefix_index):
+    daily = {m: np.diff(_prefix_index["country"][m], axis=1) for m in MEASURES}
+    return {"Daily": (pd.date_range(_prefix_index["first"], periods=_prefix_index["n_days"], freq="D"),
+                      _prefix_index["country"]["labels"], daily)}
+
+# Hourly Revenue, Quantity and Orders per country over the hours of a date window, from one bincount of the
+# window's line items (an hourly view cannot be rolled up from days); only built when it is displayed
+@st.cache_resource(max_entries=4)
+def load_hourly(cache_path, version, start, end, _window):
+    first_hour = pd.Timestamp(start)
+    n_hours = (pd.Timestamp(end) + timedelta(days=1) - first_hour) // pd.Timedelta(hours=1)
+    hour = ((_window['InvoiceDate'] - first_hour) // pd.Timedelta(hours=1)).to_numpy()
+    countries = _window['Country'].cat.codes.to_numpy().astype(np.intp)
+    n_countries = len(_window['Country'].cat.categories)
+    weights = {"Revenue": _window['Revenue'].to_numpy(), "Quantity": _window['Quantity'].to_numpy(),
+               "Orders": (~_window['InvoiceNo'].duplicated()).to_numpy()}
+    hourly = {m: np.bincount(countries * n_hours + hour, weights=w, minlength=n_countries * n_hours)
+                   .reshape(n_countries, n_hours) for m, w in weights.items()}
+    return pd.date_range(first_hour, periods=n_hours, freq="h"), _window['Country'].cat.categories, hourly
+
+# One measure at the chosen granularity for the filters. Weekly, monthly and quarterly values are
+# reductions of the daily series over contiguous period runs (np.add.reduceat), never a resample of rows.
+def granular_series(series, measure, granularity, start, end, countries=()):
+    calendar, labels, values = series["Hourly" if granularity == "Hourly" else "Daily"]
+    values = values[measure][labels.get_indexer(list(countries))] if countries else values[measure]
+    lo, hi = calendar.searchsorted([pd.Timestamp(start), pd.Timestamp(end) + timedelta(days=1)])
+    calendar, values = calendar[lo:hi], values.sum(axis=0)[lo:hi]
+    if GRANULARITIES[granularity] is None:
+        return pd.Series(values, index=calendar, name=measure)
+    period_index, sums = period_sums(values, calendar, GRANULARITIES[granularity])
+    return pd.Series(sums, index=period_index, name=measure)
+
+# Sums over the last axis of values for each period run of the daily calendar, labelled by period start
+def period_sums(values, calendar, freq):
+    periods = calendar.to_period(freq)
+    if not len(periods):
+        return periods.to_timestamp(), values[..., :0]
+    starts = np.flatnonzero(np.r_[True, np.diff(periods.asi8) != 0])
+    return periods[starts].to_timestamp(), np.add.reduceat(values, starts, axis=-1)
+
+ROLLING_WINDOWS = [7, 30, 90]
+
+# Trailing-window totals ending on every day, from a prefix-sum array (groups x days + 1): one subtraction per day
+def rolling_sums(prefix, window):
+    ends = np.arange(1, prefix.shape[1])
+    return prefix[:, ends] - prefix[:, np.maximum(ends - window, 0)]
+
+# Distinct items per group seen in the trailing window ending on every day. Each (group, item) purchase
+# day enters the count on its day and leaves it window days later or at the item's next purchase day,
+# whichever comes first, so the counts are the running sum of those entry/exit events: O(n) after one
+# stable sort of the (date-ordered) rows by group and item, with no per-window regrouping.
+def rolling_distinct(groups, n_groups, items, day, n_days, window):
+    key = groups.astype("int64") * (int(items.max(initial=0)) + 1) + items
+    order = np.argsort(key, kind="stable")
+    key, day = key[order], day[order]
+    new = np.r_[True, (key[1:] != key[:-1]) | (day[1:] != day[:-1])]
+    key, day = key[new], day[new]
+    same_item = np.r_[key[1:] == key[:-1], False]
+    leave = np.minimum(day + window, np.where(same_item, np.r_[day[1:], 0], n_days))
+    group = groups[order][new].astype(np.intp)
+    events = (np.bincount(group * (n_days + 1) + day, minlength=n_groups * (n_days + 1))
+              - np.bincount(group * (n_days + 1) + np.minimum(leave, n_days), minlength=n_groups * (n_days + 1)))
+    return np.cumsum(events.reshape(n_groups, n_days + 1), axis=1)[:, :n_days]
+
+# Trailing 7/30/90-day revenue, orders and active customers ending on every day of the calendar, overall
+# and per country, computed once per dataset version from the prefix-sum index and the distinct
+# (country, customer, day) visits of each cube month file, so the full cube is never loaded
+@st.cache_resource(max_entries=2)
+def load_rolling(cache_path, version, _prefix_index):
+    n_days = _prefix_index["n_days"]
+    labels = _prefix_index["country"]["labels"]
+    visits = []
+    with cache_lock():
+        for path in cube_files(cache_path):
+            part = pd.read_parquet(path, columns=["Date", "Country", "CustomerID"])
+            visits.append(pd.DataFrame({
+                "Country": label_codes(part['Country'], labels),
+                "CustomerID": part['CustomerID'].to_numpy(),
+                "Day": ((part['Date'] - _prefix_index["first"]) // pd.Timedelta(days=1)).to_numpy(),
+            }).drop_duplicates())
+    visits = pd.concat(visits, ignore_index=True)
+    day, customer, country = (visits[column].to_numpy() for column in ["Day", "CustomerID", "Country"])
+    rolling = {"calendar": pd.date_range(_prefix_index["first"], periods=n_days, freq="D"), "labels": labels}
+    for level, groups, n_groups in [("total", np.zeros(len(visits), dtype=np.intp), 1),
+                                    ("country", country, len(labels))]:
+        rolling[level] = {
+            "Revenue": {w: rolling_sums(_prefix_index[level]["Revenue"], w) for w in ROLLING_WINDOWS},
+            "Orders": {w: rolling_sums(_prefix_index[level]["Orders"], w) for w in ROLLING_WINDOWS},
+            "Active Customers": {w: rolling_distinct(groups, n_groups, customer, day, n_days, w) for w in ROLLING_WINDOWS},
+        }
+    return rolling
+
+# Trailing window, in points of the series' own granularity, and robust z-score beyond which a point is flagged
+ANOMALY_WINDOWS = {"Hourly": 24 * 7, "Daily": 28, "Weekly": 8, "Monthly": 6, "Quarterly": 4}
+ANOMALY_THRESHOLD = 3.5
+
+# Robust z-scores of every point of each row of Y against the median of the trailing window before it, from
+# strided window views over the whole (series x time) matrix. The scale is the MAD (x 1.4826); where the MAD is
+# zero, as in mostly-zero series, it falls back to the mean absolute deviation (x 1.253314) as in the modified
+# z-score, floored at min_scale (a scalar or one value per row). Rows are processed in blocks to bound the
+# memory of the window medians; points without a full window or with a zero scale score NaN.
+def rolling_mad_scores(Y, window, min_scale=0.0, block_rows=256):
+    Y = np.atleast_2d(np.asarray(Y, dtype="float64"))
+    min_scale = np.broadcast_to(np.asarray(min_scale, dtype="float64"), (len(Y),))
+    scores, medians = np.full(Y.shape, np.nan), np.full(Y.shape, np.nan)
+    if Y.shape[1] <= window:
+        return scores, medians
+    for lo in range(0, len(Y), block_rows):
+        block = Y[lo:lo + block_rows]
+        windows = sliding_window_view(block, window, axis=1)[:, :-1]
+        median = np.median(windows, axis=2)
+        deviation = np.abs(windows - median[..., None])
+        mad = 1.4826 * np.median(deviation, axis=2)
+        fallback = np.maximum(1.253314 * deviation.mean(axis=2), min_scale[lo:lo + block_rows, None])
+        scale = np.where(mad > 0, mad, fallback)
+        medians[lo:lo + block_rows, window:] = median
+        scores[lo:lo + block_rows, window:] = (block[:, window:] - median) / np.where(scale > 0, scale, np.nan)
+    return scores, medians
+
+# Typical revenue of a trading day of each row of Y (mean of its non-zero days): the scale floor for windows
+# with a zero MAD, so that an ordinary sale after a run of zero days is not automatically an outlier
+def trading_day_scale(Y):
+    trading = Y != 0
+    return np.abs(Y).sum(axis=1) / np.maximum(trading.sum(axis=1), 1)
+
+# Flagged days of daily revenue per country and per product, scored once per dataset version
+@st.cache_resource(max_entries=2)
+def load_anomalies(cache_path, version, _series, _prefix_index):
+    calendar, country_labels, daily = _series["Daily"]
+    flags = []
+    for level, labels, Y in [("Country", country_labels, daily["Revenue"]),
+                             ("Product", _prefix_index["product"]["labels"], np.diff(_prefix_index["product"]["Revenue"], axis=1))]:
+        scores, medians = rolling_mad_scores(Y, ANOMALY_WINDOWS["Daily"], trading_day_scale(Y))
+        rows, days = np.nonzero(np.abs(np.nan_to_num(scores)) > ANOMALY_THRESHOLD)
+        flags.append(pd.DataFrame({"Date": calendar[days], "Level": level, "Series": np.asarray(labels)[rows],
+                                   "Revenue": Y[rows, days], "Expected": medians[rows, days], "Score": scores[rows, days]}))
+    flags = pd.concat(flags, ignore_index=True)
+    flags["Direction"] = np.where(flags["Score"] > 0, "Spike", "Drop")
+    return flags.sort_values(["Date", "Level", "Series"], ignore_index=True)
+
+FORECAST_LEVELS = ["Total", "Country", "Product"]
+
+# Weekly revenue of every group of a prefix-index level over whole weeks only, so partial first and last
+# weeks do not look like drops
+def weekly_revenue(prefix_index, key):
+    calendar = pd.date_range(prefix_index["first"], periods=prefix_index["n_days"], freq="D")
+    first_monday = calendar[0] + pd.Timedelta(days=(7 - calendar[0].weekday()) % 7)
+    last_sunday = calendar[-1] - pd.Timedelta(days=(calendar[-1].weekday() + 1) % 7)
+    whole = (calendar >= first_monday) & (calendar <= last_sunday)
+    return period_sums(np.diff(prefix_index[key]["Revenue"], axis=1)[:, whole], calendar[whole], "W")
+
+# Weekly revenue forecasts for the total, every country and every product, fitted as three batched
+# 2-D problems on complete weeks of the full history and cached per dataset version and model settings
+@st.cache_resource(max_entries=4)
+def load_forecasts(cache_path, version, model, horizon, _prefix_index):
+    results = {}
+    for level, key in [("Total", "total"), ("Country", "country"), ("Product", "product")]:
+        weeks, history = weekly_revenue(_prefix_index, key)
+        t0 = time.perf_counter()
+        predicted = forecast(history, model, season=52, horizon=horizon, workers=FORECAST_WORKERS)
+        future = pd.date_range(weeks[-1] + pd.Timedelta(weeks=1), periods=horizon, freq="7D")
+        results[level] = {"labels": _prefix_index[key]["labels"], "weeks": weeks, "history": history,
+                          "future": future, "forecast": predicted, "seconds": time.perf_counter() - t0,
+                          "model": fitted_model(model, history.shape[1], 52)}
+    return results
+
+
+# Seasonal cycles available for decomposition: the series granularity and the season length in its periods
+SEASONS = {"Weekly cycle (daily revenue)": ("Daily", 7), "Yearly cycle (weekly revenue)": ("Weekly", 52)}
+DECOMPOSITION_PRODUCTS = 500
+
+# Trend, seasonal and residual revenue of the total, every country and the top products, decomposed as one
+# batched matrix per level and cached per dataset version and season
+@st.cache_resource(max_entries=4)
+def load_decompositions(cache_path, version, season, _prefix_index):
+    granularity, period = SEASONS[season]
+    results = {}
+    for level, key in [("Total", "total"), ("Country", "country"), ("Product", "product")]:
+        if granularity == "Daily":
+            dates = pd.date_range(_prefix_index["first"], periods=_prefix_index["n_days"], freq="D")
+            observed = np.diff(_prefix_index[key]["Revenue"], axis=1)
+        else:
+            dates, observed = weekly_revenue(_prefix_index, key)
+        labels = _prefix_index[key]["labels"]
+        if level == "Product":
+            top = top_k(observed.sum(axis=1), DECOMPOSITION_PRODUCTS)
+            labels, observed = labels[top], observed[top]
+        t0 = time.perf_counter()
+        trend, seasonal, residual = decompose(observed, period)
+        results[level] = {"labels": labels, "dates": dates, "Observed": observed, "Trend": trend,
+                          "Seasonal": seasonal, "Residual": residual, "seconds": time.perf_counter() - t0}
+    return results
+
+# Rows of the time-sorted dates between start and end (inclusive dates), found by binary search
+def date_rows(dates, start, end):
+    lo, hi = np.searchsorted(dates, [np.datetime64(start), np.datetime64(end + timedelta(days=1))])
+    return slice(lo, hi)
+
+# Rows matching the global filters: a binary-searched slice of the time-sorted dates, narrowed to the
+# selected countries by intersecting their row positions with that slice
+def filter_rows(dates, country_index, start, end, countries):
+    rows = date_rows(dates, start, end)
+    if not countries:
+        return rows
+    lo, hi = rows.start, rows.stop
+    positions = [country_index.get(c, np.empty(0, dtype=np.intp)) for c in countries]
+    return np.sort(np.concatenate([p[np.searchsorted(p, lo):np.searchsorted(p, hi)] for p in positions]))
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Product taxonomy: category -> keywords, checked in file order; descriptions matching none are "OTHER"
+def load_categories(path=CATEGORIES_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+# Reference per-row categorization, kept for the timing comparison in Data & Performance
+def get_category(desc, categories):
+    desc = str(desc).upper()
+    for cat, keywords in categories.items():
+        for kw in keywords:
+            if kw in desc:
+                return cat
+    return "OTHER"
+
+# Vectorized categorization of an array of descriptions: one compiled alternation per category,
+# the first matching category in taxonomy order wins. Returns codes into list(categories) + ["OTHER"].
+def categorize(descriptions, categories):
+    upper = pd.Series(descriptions, dtype="str").str.upper()
+    matches = [upper.str.contains(re.compile("|".join(map(re.escape, keywords))), na=False).to_numpy(bool)
+               for keywords in categories.values()]
+    return np.select(matches, range(len(categories)), len(categories)).astype("int8")
+
+# Category of every row, evaluated once per distinct description and broadcast through the categorical codes
+def category_codes(descriptions, categories):
+    codes = np.append(categorize(descriptions.cat.categories, categories), np.int8(len(categories)))
+    # code -1 (missing description) indexes the trailing "OTHER"
+    return pd.Categorical.from_codes(codes[descriptions.cat.codes], list(categories) + ["OTHER"])
+
+# Seconds taken by the per-row apply and by the vectorized path on the same descriptions
+def benchmark_categorization(descriptions, categories):
+    t0 = time.perf_counter()
+    old = descriptions.astype(object).apply(get_category, args=(categories,))
+    t1 = time.perf_counter()
+    new = category_codes(descriptions, categories)
+    t2 = time.perf_counter()
+    return t1 - t0, t2 - t1, bool((old.to_numpy() == np.asarray(new, dtype=object)).all())
+
+# Days since the customer's previous line item (NaN for their first), without sorting a copy of the frame
+def days_gap(frame):
+    customers = frame['CustomerID'].to_numpy()
+    dates = frame['InvoiceDate'].to_numpy()
+    order = np.lexsort((dates, customers))
+    gap = np.full(len(order), np.nan, dtype="float32")
+    gap[1:] = np.diff(dates[order]) // np.timedelta64(1, "D")
+    gap[1:][customers[order][1:] != customers[order][:-1]] = np.nan
+    out = np.empty_like(gap)
+    out[order] = gap
+    return out
+
+# Derived columns of the line items of a date window, computed from the window's slice only and shared by
+# every session: weekday and hour as uint8, category as categorical codes and the gap to the customer's
+# previous purchase within the window
+@st.cache_resource(max_entries=4)
+def load_derived(cache_path, version, categories, start, end, _df):
+    dates = _df['InvoiceDate'].dt
+    return pd.DataFrame({
+        "DayOfWeek": dates.dayofweek.to_numpy().astype("uint8"),
+        "Hour": dates.hour.to_numpy().astype("uint8"),
+        "Category": category_codes(_df['Description'], categories),
+        "DaysGap": days_gap(_df),
+    }, index=_df.index)
+
+# Derived columns of the aggregate cube rows of a date window
+@st.cache_resource(max_entries=4)
+def load_cube_derived(cache_path, version, categories, start, end, _cube):
+    return pd.DataFrame({
+        "DayOfWeek": _cube['Date'].dt.dayofweek.to_numpy().astype("uint8"),
+        "Category": category_codes(_cube['Description'], categories),
+    })
+
+# Line items and derived columns for the filters: the window itself without a country filter, otherwise
+# the selected countries' rows gathered once through the window's country index and cached per filter state
+@st.cache_resource(max_entries=8)
+def load_view(cache_path, version, categories, start, end, countries, _window, _derived, _country_index):
+    if not countries:
+        return _window, _derived
+    rows = np.sort(np.concatenate([_country_index.get(c, np.empty(0, dtype=np.intp)) for c in countries]))
+    return _window.iloc[rows], _derived.iloc[rows]
+
+# Positions of the k largest values, largest first with ties broken by position, found with an O(n)
+# argpartition-style selection instead of sorting the whole array. NaN ranks below every number, so the
+# result always holds min(k, n) positions.
+def top_k(values, k):
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        values = np.where(np.isnan(values), -np.inf, values)
+    if 0 < k < len(values):
+        kth = np.partition(values, len(values) - k)[len(values) - k]
+        candidates = np.flatnonzero(values >= kth)
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.lexsort((candidates, -values[candidates]))[:k]]
+
+# Top-k entries of a grouped Series or rows of a frame by one column, in descending order
+def top_k_series(series, k=10):
+    return series.iloc[top_k(series.to_numpy(), k)]
+
+def top_k_rows(frame, column, k=10):
+    return frame.iloc[top_k(frame[column].to_numpy(), k)]
+
+# Cumulative revenue share that closes classes A and B; the remaining products are C
+ABC_THRESHOLDS = (0.8, 0.95)
+
+# Pareto / ABC classification of products from one descending sort and a cumulative sum. A product's
+# class is decided by the share of revenue ranked above it, so the product crossing 80% is still an A.
+def abc_classes(revenue, thresholds=ABC_THRESHOLDS):
+    order = np.argsort(-revenue.to_numpy(), kind="stable")
+    ranked = revenue.iloc[order]
+    share = np.cumsum(ranked.to_numpy()) / max(ranked.sum(), 1e-12)
+    classes = np.searchsorted(thresholds, share - ranked.to_numpy() / max(ranked.sum(), 1e-12), side="right")
+    return pd.DataFrame({"Revenue": ranked.to_numpy(), "CumulativeShare": share,
+                         "Class": pd.Categorical.from_codes(classes, ["A", "B", "C"])},
+                        index=ranked.index.rename("Description"))
+
+# Most points a line trace sends to the browser: about two per pixel of a full-width chart
+CHART_POINTS = int(os.environ.get("RETAIL_CHART_POINTS", "2000"))
+
+# Largest-Triangle-Three-Buckets: positions of n_out points of (x, y) that keep the visual shape of the line.
+# The first and last points are kept; from every bucket in between, the point forming the largest triangle
+# with the previously kept point and the mean of the next bucket.
+def lttb(x, y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x, y = np.asarray(x, dtype="float64"), np.nan_to_num(np.asarray(y, dtype="float64"))
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    edges = np.append(edges, n)
+    keep = np.empty(n_out, dtype=np.intp)
+    keep[0], keep[-1], a = 0, n - 1, 0
+    for i in range(n_out - 2):
+        lo, hi, next_hi = edges[i], edges[i + 1], edges[i + 2]
+        next_x, next_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+# Downsample every line trace of a figure to at most max_points with LTTB. Datetime axes are compared as
+# integers and categorical ones by position; marker-only traces are left untouched.
+def downsample(fig, max_points=CHART_POINTS):
+    for trace in fig.data:
+        if trace.type not in ("scatter", "scattergl") or "lines" not in (trace.mode or "lines"):
+            continue
+        if trace.y is None or len(trace.y) <= max_points:
+            continue
+        x = np.asarray(trace.x) if trace.x is not None else np.arange(len(trace.y))
+        if np.issubdtype(x.dtype, np.datetime64):
+            position = x.astype("datetime64[us]").astype("int64")
+        elif np.issubdtype(x.dtype, np.number):
+            position = x
+        else:
+            position = np.arange(len(x))
+        keep = lttb(position, trace.y, max_points)
+        trace.update(x=x[keep], y=np.asarray(trace.y)[keep])
+        if trace.customdata is not None:
+            trace.customdata = np.asarray(trace.customdata)[keep]
+    return fig
+
+# px.line with its traces downsampled before they are sent to the browser; every line chart goes through it
+def line_chart(*args, **kwargs):
+    return downsample(px.line(*args, **kwargs))
+
+# Sales Performance KPIs from one sweep of integer bincounts over factorized keys
+# (product, customer, weekday and category codes of the cube, hour codes of the line items)
+# instead of a separate hash groupby over the rows for every chart
+def compute_sales_kpis(cube, cube_derived, df, derived):
+    quantity = cube['Quantity'].to_numpy()
+    revenue = cube['Revenue'].to_numpy()
+    products = cube['Description'].cat.categories
+    product = cube['Description'].cat.codes.to_numpy()
+    customer, customers = pd.factorize(cube['CustomerID'])
+    category = cube_derived['Category'].cat.codes.to_numpy()
+    day = cube_derived['DayOfWeek'].to_numpy()
+    hour = derived['Hour'].to_numpy()
+
+    # line counts only where a zero-revenue group must still be told apart from an absent one;
+    # every cleaned line has a positive quantity, so a product was sold exactly when its quantity is
+    def sums(codes, n, weights, seen=False):
+        totals = np.bincount(codes, weights=weights, minlength=n)
+        return (totals, np.bincount(codes, minlength=n) > 0) if seen else totals
+
+    product_qty = sums(product, len(products), quantity)
+    sold = product_qty > 0
+    product_rev = sums(product, len(products), revenue)
+    customer_rev = sums(customer, len(customers), revenue)
+    day_rev, day_seen = sums(day, 7, revenue, seen=True)
+    hour_rev, hour_seen = sums(hour, 24, df['Revenue'].to_numpy(), seen=True)
+    category_rev, category_seen = sums(category, len(cube_derived['Category'].cat.categories), revenue, seen=True)
+    return {
+        "customers": len(customers),
+        "product_qty": pd.Series(product_qty[sold].astype("int64"), index=products[sold], name="Quantity"),
+        "product_rev": pd.Series(product_rev[sold], index=products[sold], name="Revenue"),
+        "product_abc": abc_classes(pd.Series(product_rev[sold], index=products[sold])),
+        "customer_rev": pd.Series(customer_rev, index=customers, name="Revenue"),
+        "day_rev": pd.Series(day_rev[day_seen], index=np.array(DAY_NAMES)[day_seen], name="Revenue"),
+        "hour_rev": pd.Series(hour_rev[hour_seen], index=np.arange(24)[hour_seen], name="Revenue"),
+        "category_rev": pd.Series(category_rev[category_seen],
+                                  index=cube_derived['Category'].cat.categories[category_seen], name="Revenue"),
+    }
+
+# KPI results cached per dataset version and filter state
+@st.cache_data(max_entries=32)
+def sales_kpis(cache_path, version, start, end, countries, categories, _cube, _cube_derived, _df, _derived):
+    return compute_sales_kpis(_cube, _cube_derived, _df, _derived)
+
+# Revenue and orders of line items on a 7 x 24 weekday x hour grid, each from one bincount of the combined
+# uint8 day and hour codes; an order is counted in the cell of its invoice's first line
+def weekday_hour_grid(day, hour, revenue, invoices):
+    cell = day.astype(np.intp) * 24 + hour
+    first = ~pd.Series(invoices).duplicated().to_numpy()
+    return {"Revenue": np.bincount(cell, weights=revenue, minlength=7 * 24).reshape(7, 24),
+            "Orders": np.bincount(cell[first], minlength=7 * 24).reshape(7, 24)}
+
+# Weekday x hour grid of the filtered line items, optionally narrowed to one product, cached per filter state
+@st.cache_data(max_entries=32)
+def weekday_hour_kpis(cache_path, version, start, end, countries, product, _df, _derived):
+    rows = slice(None)
+    if product is not None:
+        rows = _df['Description'].cat.codes.to_numpy() == _df['Description'].cat.categories.get_loc(product)
+    return weekday_hour_grid(_derived['DayOfWeek'].to_numpy()[rows], _derived['Hour'].to_numpy()[rows],
+                             _df['Revenue'].to_numpy()[rows], _df['InvoiceNo'].to_numpy()[rows])
+
+# The per-chart scans Sales Performance used to run over the line items, for the timing comparison
+def legacy_sales_kpis(df, derived):
+    return (df['Revenue'].sum(), df['InvoiceNo'].nunique(), df['CustomerID'].nunique(),
+            df.groupby("Description")["Quantity"].sum(), df.groupby("Description")["Revenue"].sum(),
+            df.groupby("CustomerID")["Revenue"].sum(), df.groupby(df['InvoiceDate'].dt.day_name())["Revenue"].sum(),
+            df.groupby(derived["Hour"])["Revenue"].sum(), df.groupby(derived["Category"])["Revenue"].sum())
+
+def benchmark_sales_kpis(cube, cube_derived, df, derived, repeats=3):
+    timings = {}
+    for name, run in [("Per-chart scans", lambda: legacy_sales_kpis(df, derived)),
+                      ("KPI engine", lambda: compute_sales_kpis(cube, cube_derived, df, derived))]:
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            run()
+        timings[name] = (time.perf_counter() - t0) / repeats
+    return timings
+
+# RFM table of the line items from one groupby over the integer CustomerID with native aggregations:
+# Recency in days from the last purchase to the snapshot date, Frequency as distinct invoices,
+# Monetary as revenue and Diversity as distinct products
+def compute_rfm(frame, snapshot_date):
+    items = pd.DataFrame({"CustomerID": frame['CustomerID'].to_numpy(), "InvoiceDate": frame['InvoiceDate'].to_numpy(),
+                          "InvoiceNo": frame['InvoiceNo'].to_numpy(), "Revenue": frame['Revenue'].to_numpy(),
+                          "Product": frame['Description'].cat.codes.to_numpy()})
+    rfm = items.groupby("CustomerID").agg(Last=("InvoiceDate", "max"), Frequency=("InvoiceNo", "nunique"),
+                                          Monetary=("Revenue", "sum"), Diversity=("Product", "nunique"))
+    rfm.insert(0, "Recency", (snapshot_date - rfm.pop("Last")).dt.days)
+    return rfm
+
+# Named segments on the grid of Recency (rows) and Frequency (columns) quintile scores, 1 = worst
+SEGMENTS = ["Champions", "Loyal Customers", "Potential Loyalists", "New Customers", "Promising", "Need Attention",
+            "About to Sleep", "Can't Lose Them", "At Risk", "Hibernating"]
+SEGMENT_GRID = np.array([
+    ["Hibernating", "Hibernating", "At Risk", "At Risk", "Can't Lose Them"],
+    ["Hibernating", "Hibernating", "At Risk", "At Risk", "Can't Lose Them"],
+    ["About to Sleep", "About to Sleep", "Need Attention", "Loyal Customers", "Loyal Customers"],
+    ["Promising", "Potential Loyalists", "Potential Loyalists", "Loyal Customers", "Loyal Customers"],
+    ["New Customers", "Potential Loyalists", "Potential Loyalists", "Champions", "Champions"],
+])
+SEGMENT_CODES = pd.Index(SEGMENTS).get_indexer(SEGMENT_GRID.ravel()).reshape(5, 5)
+
+# Quintile scores 1-5 over the whole customer table (recent, frequent and high-spending customers score 5),
+# from one tie-aware rank per column so equal values always share a score (quintiles may be unequal in size),
+# and the segment of each customer looked up on the R x F grid
+def score_rfm(rfm):
+    scores = {}
+    for column, score, ascending in [("Recency", "R", False), ("Frequency", "F", True), ("Monetary", "M", True)]:
+        rank = rfm[column].rank(method="min", ascending=ascending, pct=True).to_numpy()
+        scores[score] = np.ceil(rank * 5).astype("int8")
+    rfm = rfm.assign(**scores)
+    rfm["RFM"] = rfm["R"].astype("int16") * 100 + rfm["F"] * 10 + rfm["M"]
+    rfm["Segment"] = pd.Categorical.from_codes(SEGMENT_CODES[rfm["R"] - 1, rfm["F"] - 1], SEGMENTS)
+    return rfm
+
+# Customers, averages and revenue share of every segment
+def segment_summary(rfm):
+    summary = rfm.groupby("Segment", observed=False).agg(
+        Customers=("Monetary", "size"), Recency=("Recency", "mean"), Frequency=("Frequency", "mean"),
+        Monetary=("Monetary", "mean"), Revenue=("Monetary", "sum"))
+    summary.insert(1, "Share of Customers", summary["Customers"] / max(len(rfm), 1))
+    summary["Share of Revenue"] = summary["Revenue"] / max(summary["Revenue"].sum(), 1e-12)
+    return summary
+
+# Positions of each segment's customers, highest spend first, from one sort by segment and spend
+def segment_members(rfm):
+    codes = rfm["Segment"].cat.codes.to_numpy()
+    order = np.lexsort((-rfm["Monetary"].to_numpy(), codes))
+    bounds = np.r_[0, np.cumsum(np.bincount(codes, minlength=len(SEGMENTS)))]
+    return {segment: order[bounds[i]:bounds[i + 1]] for i, segment in enumerate(SEGMENTS)}
+
+# Scored RFM table, segment summary and segment members as of a snapshot date, using only purchases before it;
+# cached per dataset version, filter state and snapshot
+@st.cache_data(max_entries=32)
+def rfm_segments(cache_path, version, start, end, countries, snapshot_date, _df):
+    before = _df['InvoiceDate'].searchsorted(pd.Timestamp(snapshot_date))
+    rfm = score_rfm(compute_rfm(_df.iloc[:before], pd.Timestamp(snapshot_date)))
+    return {"rfm": rfm, "summary": segment_summary(rfm), "members": segment_members(rfm)}
+
+# Customers sampled for the k-sweep and for the silhouette scores
+SWEEP_SAMPLE = 10_000
+
+# Clustering model for k clusters, fitted on the full-history RFM table of a dataset version and persisted
+# under the partition cache, so it is only refitted when the data or k change. Models of older dataset
+# versions are removed once a new one is written, as write_shared does for the shared store.
+@st.cache_resource(max_entries=8)
+def load_cluster_model(cache_path, version, k, _df):
+    models_dir = os.path.join(cache_path, "_models")
+    path = os.path.join(models_dir, f"kmeans-{version}-k{k}.joblib")
+    if os.path.exists(path):
+        return joblib.load(path)
+    rfm = compute_rfm(_df, _df['InvoiceDate'].max() + timedelta(days=1))
+    model = fit_model(rfm[FEATURES].to_numpy(), k)
+    os.makedirs(models_dir, exist_ok=True)
+    with cache_lock():
+        joblib.dump(model, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        for name in os.listdir(models_dir):
+            if not name.startswith(f"kmeans-{version}-k") or name.endswith(".tmp"):
+                os.remove(os.path.join(models_dir, name))
+    return model
+
+# Process pool for k-sweeps, shared by all sessions and started with spawn like the forecast pool
+@st.cache_resource
+def load_sweep_pool():
+    return ProcessPoolExecutor(SWEEP_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+# The per-customer lambda aggregation Customer Segmentation used to run, for the timing comparison
+def legacy_rfm(frame, snapshot_date):
+    rfm = frame.groupby('CustomerID').agg({
+        'InvoiceDate': lambda x: (snapshot_date - x.max()).days,
+        'InvoiceNo': 'count',
+        'Revenue': 'sum'
+    })
+    rfm.columns = ['Recency', 'Frequency', 'Monetary']
+    rfm['Diversity'] = frame.groupby("CustomerID")["Description"].nunique()
+    return rfm
+
+# Synthetic line items for n_customers customers over a year, about lines_per_customer lines each
+def synthetic_line_items(n_customers, lines_per_customer=5, n_products=4000, seed=0):
+    rng = np.random.default_rng(seed)
+    n_rows = n_customers * lines_per_customer
+    customer = rng.integers(0, n_customers, n_rows, dtype=np.int32)
+    return pd.DataFrame({
+        "CustomerID": customer,
+        "InvoiceNo": customer * 8 + rng.integers(0, 8, n_rows, dtype=np.int32),
+        "InvoiceDate": pd.Timestamp("2011-01-01") + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, n_rows), unit="min"),
+        "Revenue": rng.gamma(2.0, 10.0, n_rows),
+        "Description": pd.Categorical.from_codes(rng.integers(0, n_products, n_rows),
+                                                 [f"PRODUCT {i}" for i in range(n_products)]),
+    })
+
+# Seconds for the RFM engine on n_customers synthetic customers and for the lambda aggregation on a
+# subset of legacy_customers of them (it calls Python once per customer), with the rate per million customers
+def benchmark_rfm(n_customers, legacy_customers=20_000):
+    items = synthetic_line_items(n_customers)
+    snapshot_date = items['InvoiceDate'].max() + timedelta(days=1)
+    subset = items[items['CustomerID'] < legacy_customers]
+    rows = []
+    for name, frame, run in [("Lambda aggregation", subset, legacy_rfm), ("RFM engine", items, compute_rfm)]:
+        t0 = time.perf_counter()
+        run(frame, snapshot_date)
+        seconds = time.perf_counter() - t0
+        customers = frame['CustomerID'].nunique()
+        rows.append({"Method": name, "Customers": customers, "Rows": len(frame), "Seconds": seconds,
+                     "Seconds per 1M customers": seconds * 1e6 / customers})
+    return pd.DataFrame(rows).set_index("Method")
+
+cache_path = build_cache(source_key(DATA_PATH))
+version = sync_incoming(cache_path)
+categories = load_categories()
+all_df = load_shared(cache_path, version)
+prefix_index = load_prefix_index(cache_path, version)
+series = load_series(cache_path, version, prefix_index)
+min_date = pd.Timestamp(all_df['InvoiceDate'].iloc[0]).date()
+max_date = pd.Timestamp(all_df['InvoiceDate'].iloc[-1]).date()
 
 # Sidebar for navigation
 st.sidebar.title("Navigation")
 sections = ["Sales Performance", "Time-Series Analysis", "Customer Segmentation",
             "Basket Analysis", "Country-Level Analysis", "Price & Quantity Insights",
-            "Fraud Detection", "Customer Retention"]
+            "Fraud Detection", "Customer Retention", "Data & Performance"]
 choice = st.sidebar.radio("Go to", sections)
 
+# Global filters. Every section works on the same filtered view: without a country filter it is a
+# zero-copy slice of the time-sorted data, with one it is gathered through the per-country row index.
+# Line-item stores (derived columns, country index, hourly series) are built from the window slice only,
+# and the cube rows come from the month files overlapping the window.
+st.sidebar.title("Filters")
+date_range = st.sidebar.date_input("Date range", (min_date, max_date), min_value=min_date, max_value=max_date)
+start, end = date_range if len(date_range) == 2 else (min_date, max_date)
+countries = tuple(st.sidebar.multiselect("Country", list(prefix_index["country"]["labels"])))
+window = all_df.iloc[date_rows(all_df['InvoiceDate'].to_numpy(), start, end)]
+window_derived = load_derived(cache_path, version, categories, start, end, window)
+df, derived = load_view(cache_path, version, categories, start, end, countries, window, window_derived,
+                        load_country_index(cache_path, version, start, end, window) if countries else None)
+cube_window = load_cube(cache_path, version, start, end)
+cube_window_derived = load_cube_derived(cache_path, version, categories, start, end, cube_window)
+cube_rows = filter_rows(cube_window['Date'].to_numpy(),
+                        load_cube_index(cache_path, version, start, end, cube_window) if countries else None,
+                        start, end, countries)
+cube, cube_derived = cube_window.iloc[cube_rows], cube_window_derived.iloc[cube_rows]
+
+# Range totals for the current filters from the prefix-sum index
+def filtered_total(measure, range_start=start, range_end=end):
+    if countries:
+        return range_total(prefix_index, "country", measure, range_start, range_end, countries).sum()
+    return range_total(prefix_index, "total", measure, range_start, range_end).sum()
+
 # Section: Sales Performance
 if choice == "Sales Performance":
     st.header("1️⃣ Sales Performance Analysis")
     
+    kpis = sales_kpis(cache_path, version, start, end, countries, categories, cube, cube_derived, df, derived)
+
     # KPI cards
     col1, col2, col3 = st.columns(3)
-    col1.metric("Total Revenue", f"${df['Revenue'].sum():,.0f}")
-    col2.metric("Total Orders", f"{df['InvoiceNo'].nunique()}")
-    col3.metric("Total Customers", f"{df['CustomerID'].nunique()}")
+    col1.metric("Total Revenue", f"${filtered_total('Revenue'):,.0f}")
+    col2.metric("Total Orders", f"{filtered_total('Orders'):.0f}")
+    col3.metric("Total Customers", f"{kpis['customers']}")
     
     # Top products
     st.subheader("Top Products")
-    top_products_qty = df.groupby("Description")["Quantity"].sum().sort_values(ascending=False).head(10)
-    top_products_rev = df.groupby("Description")["Revenue"].sum().sort_values(ascending=False).head(10)
+    top_products_qty = top_k_series(kpis["product_qty"], 10)
+    top_products_rev = top_k_series(kpis["product_rev"], 10)
     
     col1, col2 = st.columns(2)
     fig_qty = px.bar(top_products_qty, x=top_products_qty.index, y=top_products_qty.values,
@@ -53,18 +1113,28 @@ if choice == "Sales Performance":
     col1.plotly_chart(fig_qty, use_container_width=True)
     col2.plotly_chart(fig_rev, use_container_width=True)
     
+    # ABC classification
+    st.subheader("ABC Product Classification")
+    abc = kpis["product_abc"]
+    abc_summary = abc.groupby("Class", observed=False).agg(Products=("Revenue", "size"), Revenue=("Revenue", "sum"))
+    abc_summary["Share of Products"] = abc_summary["Products"] / max(len(abc), 1)
+    abc_summary["Share of Revenue"] = abc_summary["Revenue"] / max(abc["Revenue"].sum(), 1e-12)
+    col1, col2 = st.columns(2)
+    fig_abc = line_chart(x=np.arange(1, len(abc) + 1), y=abc["CumulativeShare"].to_numpy(), color=abc["Class"].astype(str),
+                      labels={"x": "Product Rank", "y": "Cumulative Revenue Share", "color": "Class"}, title="Pareto Curve")
+    col1.plotly_chart(fig_abc, use_container_width=True)
+    col2.dataframe(abc_summary.style.format({"Revenue": "${:,.0f}", "Share of Products": "{:.1%}", "Share of Revenue": "{:.1%}"}))
+    
     # Top customers
     st.subheader("Top Customers")
-    top_customers = df.groupby("CustomerID")["Revenue"].sum().sort_values(ascending=False).head(10)
+    top_customers = top_k_series(kpis["customer_rev"], 10)
     fig_cust = px.bar(top_customers, x=top_customers.index, y=top_customers.values,
                       labels={"x":"CustomerID","y":"Revenue"}, title="Top 10 Customers")
     st.plotly_chart(fig_cust, use_container_width=True)
     
-    # Best-selling days & hours
-    df['DayOfWeek'] = df['InvoiceDate'].dt.day_name()
-    df['Hour'] = df['InvoiceDate'].dt.hour
-    sales_by_day = df.groupby("DayOfWeek")["Revenue"].sum()
-    sales_by_hour = df.groupby("Hour")["Revenue"].sum()
+    # Best-selling days & hours; the cube has daily grain, so hours come from the line items
+    sales_by_day = kpis["day_rev"]
+    sales_by_hour = kpis["hour_rev"]
     
     col1, col2 = st.columns(2)
     fig_day = px.bar(sales_by_day, x=sales_by_day.index, y=sales_by_day.values, title="Sales by Day")
@@ -72,16 +1142,20 @@ if choice == "Sales Performance":
     col1.plotly_chart(fig_day, use_container_width=True)
     col2.plotly_chart(fig_hour, use_container_width=True)
     
+    # Weekday x hour heatmap, for all products or a single one
+    col1, col2 = st.columns(2)
+    heat_product = col1.selectbox("Product", ["All products"] + sorted(kpis["product_rev"].index))
+    heat_measure = col2.radio("Measure", ["Revenue", "Orders"], horizontal=True)
+    grid = weekday_hour_kpis(cache_path, version, start, end, countries,
+                             None if heat_product == "All products" else heat_product, df, derived)
+    fig_heat = px.imshow(grid[heat_measure], x=list(range(24)), y=DAY_NAMES, aspect="auto",
+                         color_continuous_scale="Blues", labels={"x": "Hour", "y": "Day", "color": heat_measure},
+                         title=f"{heat_measure} by Day and Hour")
+    st.plotly_chart(fig_heat, use_container_width=True)
+    
     # Product categories
     st.subheader("Most Profitable Product Categories")
-    def get_category(desc):
-        keywords = ["HOLDER","SET","CUP","BOTTLE","LANTERN","HEART"]
-        for k in keywords:
-            if k in str(desc).upper():
-                return k
-        return "OTHER"
-    df['Category'] = df['Description'].apply(get_category)
-    category_revenue = df.groupby("Category")["Revenue"].sum().sort_values(ascending=False)
+    category_revenue = kpis["category_rev"].sort_values(ascending=False)
     fig_cat = px.bar(category_revenue, x=category_revenue.index, y=category_revenue.values,
                      title="Revenue by Category")
     st.plotly_chart(fig_cat, use_container_width=True)
@@ -90,38 +1164,201 @@ if choice == "Sales Performance":
 elif choice == "Time-Series Analysis":
     st.header("2️⃣ Time-Series & Seasonal Analysis")
     
-    df['Month'] = df['InvoiceDate'].dt.to_period("M")
-    monthly_sales = df.groupby("Month")["Revenue"].sum().to_timestamp()
-    fig_month = px.line(monthly_sales, x=monthly_sales.index, y=monthly_sales.values, title="Monthly Sales Trend")
+    # KPI cards for the selected range against the period of equal length just before it
+    previous_end = start - timedelta(days=1)
+    previous_start = previous_end - (end - start)
+    col1, col2, col3 = st.columns(3)
+    for col, measure, fmt in [(col1, "Revenue", "${:,.0f}"), (col2, "Orders", "{:,.0f}"), (col3, "Quantity", "{:,.0f}")]:
+        current, previous = filtered_total(measure), filtered_total(measure, previous_start, previous_end)
+        col.metric(f"{measure} in Range", fmt.format(current),
+                   f"{(current - previous) / previous:+.1%} vs previous period" if previous else None)
+    
+    granularity = st.radio("Granularity", list(GRANULARITIES), index=3, horizontal=True)
+    if granularity == "Hourly":
+        series = dict(series, Hourly=load_hourly(cache_path, version, start, end, window))
+    sales = granular_series(series, "Revenue", granularity, start, end, countries)
+    fig_month = line_chart(sales.rename_axis("Date").reset_index(), x="Date", y="Revenue", title=f"{granularity} Sales Trend")
+    scores, _ = rolling_mad_scores(sales.to_numpy(), ANOMALY_WINDOWS[granularity])
+    flagged = sales[np.abs(np.nan_to_num(scores[0])) > ANOMALY_THRESHOLD]
+    fig_month.add_scatter(x=flagged.index, y=flagged.values, mode="markers", name="Anomaly",
+                          marker=dict(color="red", size=9, symbol="x"))
     st.plotly_chart(fig_month)
     
+    # Trailing 7/30/90-day KPIs ending on each day of the range; with a country filter the selected countries
+    # are added up (a customer buying from two of them counts in both)
+    st.subheader("Rolling KPIs")
+    rolling = load_rolling(cache_path, version, prefix_index)
+    rolling_measure = st.selectbox("Rolling measure", ["Revenue", "Orders", "Active Customers"])
+    lo, hi = rolling["calendar"].searchsorted([pd.Timestamp(start), pd.Timestamp(end) + timedelta(days=1)])
+    if countries:
+        selected = rolling["labels"].get_indexer(list(countries))
+        trailing = {w: values[selected].sum(axis=0) for w, values in rolling["country"][rolling_measure].items()}
+    else:
+        trailing = {w: values[0] for w, values in rolling["total"][rolling_measure].items()}
+    cols = st.columns(len(ROLLING_WINDOWS))
+    for col, days in zip(cols, ROLLING_WINDOWS):
+        value = trailing[days][hi - 1] if hi > lo else 0
+        col.metric(f"{rolling_measure}, last {days} days", f"${value:,.0f}" if rolling_measure == "Revenue" else f"{value:,.0f}")
+    rolling_frame = pd.DataFrame({f"{w} days": trailing[w][lo:hi] for w in ROLLING_WINDOWS},
+                                 index=rolling["calendar"][lo:hi].rename("Date"))
+    fig_rolling = line_chart(rolling_frame.reset_index().melt("Date", var_name="Window", value_name=rolling_measure),
+                             x="Date", y=rolling_measure, color="Window", title=f"Trailing {rolling_measure}")
+    st.plotly_chart(fig_rolling, use_container_width=True)
+    
+    # Per-country values of the windows ending on the last day of the range
+    by_country = pd.DataFrame({f"{w} days": values[:, hi - 1] if hi > lo else 0
+                               for w, values in rolling["country"][rolling_measure].items()},
+                              index=rolling["labels"].rename("Country"))
+    if countries:
+        by_country = by_country.loc[list(countries)]
+    st.dataframe(by_country[by_country.any(axis=1)].sort_values(f"{ROLLING_WINDOWS[-1]} days", ascending=False))
+    
+    # Unusual days per country and per product
+    anomalies = load_anomalies(cache_path, version, series, prefix_index)
+    anomalies = anomalies[(anomalies['Date'] >= pd.Timestamp(start)) & (anomalies['Date'] <= pd.Timestamp(end))]
+    if countries:
+        anomalies = anomalies[(anomalies['Level'] == "Product") | anomalies['Series'].isin(countries)]
+    with st.expander(f"Flagged days: {len(anomalies):,} (rolling {ANOMALY_WINDOWS['Daily']}-day median/MAD, "
+                     f"|score| > {ANOMALY_THRESHOLD})"):
+        st.dataframe(anomalies)
+        st.download_button("Export anomalies (CSV)", anomalies.to_csv(index=False), "anomalies.csv", "text/csv")
+    
+    monthly_sales = granular_series(series, "Revenue", "Monthly", start, end, countries)
+    
     yoy_growth = monthly_sales.pct_change(12).dropna()
     mom_growth = monthly_sales.pct_change().dropna()
-    fig_yoy = px.line(yoy_growth, x=yoy_growth.index, y=yoy_growth.values, title="YoY Growth")
-    fig_mom = px.line(mom_growth, x=mom_growth.index, y=mom_growth.values, title="MoM Growth")
+    # filtered windows can be shorter than the growth period, so the series may be empty
+    fig_yoy = line_chart(yoy_growth.rename_axis("Month").reset_index(name="Growth"), x="Month", y="Growth", title="YoY Growth")
+    fig_mom = line_chart(mom_growth.rename_axis("Month").reset_index(name="Growth"), x="Month", y="Growth", title="MoM Growth")
     
     col1, col2 = st.columns(2)
     col1.plotly_chart(fig_yoy, use_container_width=True)
     col2.plotly_chart(fig_mom, use_container_width=True)
+    
+    # Forecasts
+    st.subheader("Weekly Revenue Forecast")
+    col1, col2, col3 = st.columns(3)
+    model = col1.selectbox("Model", list(MODELS))
+    horizon = col2.slider("Horizon (weeks)", 4, 26, 12)
+    level = col3.selectbox("Series", FORECAST_LEVELS)
+    forecasts = load_forecasts(cache_path, version, model, horizon, prefix_index)[level]
+    if level == "Total":
+        row = 0
+    else:
+        options = list(countries) if level == "Country" and countries else list(forecasts["labels"])
+        if level == "Product":
+            options = list(top_k_series(pd.Series(forecasts["history"].sum(axis=1), index=forecasts["labels"]), 200).index)
+        row = forecasts["labels"].get_loc(st.selectbox(level, options))
+    history = pd.DataFrame({"Week": forecasts["weeks"], "Revenue": forecasts["history"][row], "Series": "Actual"})
+    future = pd.DataFrame({"Week": forecasts["future"], "Revenue": forecasts["forecast"][row], "Series": "Forecast"})
+    fig_forecast = line_chart(pd.concat([history, future]), x="Week", y="Revenue", color="Series",
+                           title=f"{forecasts['model']} Forecast")
+    st.plotly_chart(fig_forecast, use_container_width=True)
+    st.caption(f"{len(forecasts['labels']):,} {level.lower()} series forecast with {forecasts['model']} "
+               f"in {forecasts['seconds']:.2f}s")
+    if forecasts["model"] != model:
+        st.info(f"{len(forecasts['weeks'])} whole weeks of history are too few for {model}, "
+                f"so {forecasts['model']} was used instead")
+    
+    # Classical decomposition of one series, shown over the selected date range
+    st.subheader("Seasonal Decomposition")
+    col1, col2 = st.columns(2)
+    # a classical decomposition needs two full cycles, so cycles longer than half the history are not offered
+    n_periods = {"Daily": prefix_index["n_days"], "Weekly": len(weekly_revenue(prefix_index, "total")[0])}
+    seasons = [name for name, (granularity, period) in SEASONS.items() if n_periods[granularity] >= 2 * period]
+    hidden = [name for name in SEASONS if name not in seasons]
+    if hidden:
+        st.caption(f"Not enough history for: {', '.join(hidden)} (two full cycles are needed)")
+    if not seasons:
+        st.warning("Not enough history for a seasonal decomposition (two full weeks are needed)")
+    else:
+        season = col1.selectbox("Season", seasons)
+        decomposition_level = col2.selectbox("Decomposed series", FORECAST_LEVELS)
+        decomposition = load_decompositions(cache_path, version, season, prefix_index)[decomposition_level]
+        if decomposition_level == "Total":
+            row = 0
+        else:
+            options = list(decomposition["labels"])
+            if decomposition_level == "Country" and countries:
+                options = list(countries)
+            row = decomposition["labels"].get_loc(st.selectbox(f"{decomposition_level} to decompose", options))
+        lo, hi = decomposition["dates"].searchsorted([pd.Timestamp(start), pd.Timestamp(end) + timedelta(days=1)])
+        components = pd.DataFrame({c: decomposition[c][row, lo:hi] for c in ["Observed", "Trend", "Seasonal", "Residual"]},
+                                  index=decomposition["dates"][lo:hi].rename("Date"))
+        fig_decomposition = line_chart(components.reset_index().melt("Date", var_name="Component", value_name="Revenue"),
+                                       x="Date", y="Revenue", facet_row="Component", height=700,
+                                       title=f"{season}: {decomposition['labels'][row]}")
+        fig_decomposition.update_yaxes(matches=None)
+        st.plotly_chart(fig_decomposition, use_container_width=True)
+        st.caption(f"{len(decomposition['labels']):,} {decomposition_level.lower()} series decomposed in "
+                   f"{decomposition['seconds']:.2f}s")
 
 # --- Section: Customer Segmentation ---
 elif choice == "Customer Segmentation":
     st.header("3️⃣ Customer Segmentation")
-    snapshot_date = df['InvoiceDate'].max() + timedelta(days=1)
-    rfm = df.groupby('CustomerID').agg({
-        'InvoiceDate': lambda x: (snapshot_date - x.max()).days,
-        'InvoiceNo': 'count',
-        'Revenue': 'sum'
-    })
-    rfm.columns = ['Recency','Frequency','Monetary']
-    diversity = df.groupby("CustomerID")["Description"].nunique()
-    rfm['Diversity'] = diversity
-    st.dataframe(rfm.head(10))
+    last_purchase = df['InvoiceDate'].max() if len(df) else pd.Timestamp(end)
+    snapshot_date = st.date_input("Snapshot date", (last_purchase + timedelta(days=1)).date(),
+                                  min_value=start + timedelta(days=1), max_value=end + timedelta(days=1))
+    segments = rfm_segments(cache_path, version, start, end, countries, snapshot_date, df)
+    rfm, summary = segments["rfm"], segments["summary"]
+    st.caption(f"{len(rfm):,} customers with purchases before {snapshot_date}; Frequency counts distinct invoices, "
+               f"R/F/M are quintile scores (5 = best, tied values share a score)")
+    
+    # Segment summary
+    col1, col2 = st.columns(2)
+    fig_segments = px.bar(summary.reset_index(), x="Segment", y="Customers", title="Customers by Segment")
+    fig_segment_rev = px.bar(summary.reset_index(), x="Segment", y="Revenue", title="Revenue by Segment")
+    col1.plotly_chart(fig_segments, use_container_width=True)
+    col2.plotly_chart(fig_segment_rev, use_container_width=True)
+    st.dataframe(summary.style.format({"Share of Customers": "{:.1%}", "Recency": "{:,.0f}", "Frequency": "{:,.1f}",
+                                       "Monetary": "${:,.0f}", "Revenue": "${:,.0f}", "Share of Revenue": "{:.1%}"}))
+    
+    # Customers of one segment, highest spend first
+    segment = st.selectbox("Segment", SEGMENTS)
+    members = rfm.iloc[segments["members"][segment]]
+    st.write(f"{len(members):,} customers in {segment}")
+    st.dataframe(members.head(500))
+    st.download_button(f"Export {segment} customers (CSV)", members.to_csv(), f"{segment.lower().replace(' ', '_')}.csv",
+                       "text/csv")
+    
+    # K-means clusters of the scaled RFM + Diversity features, from the model persisted for this version and k
+    st.subheader("Customer Clusters")
+    k = st.slider("Clusters (k)", 2, 10, 4)
+    model = load_cluster_model(cache_path, version, k, all_df)
+    clusters = pd.Series(assign(model, rfm[FEATURES].to_numpy()), index=rfm.index, name="Cluster")
+    profile = rfm[FEATURES].groupby(clusters).mean()
+    profile.insert(0, "Customers", clusters.value_counts().sort_index())
+    profile["Revenue"] = rfm["Monetary"].groupby(clusters).sum()
+    col1, col2 = st.columns(2)
+    shown = np.random.default_rng(0).choice(len(rfm), min(5000, len(rfm)), replace=False)
+    fig_clusters = px.scatter(rfm.iloc[shown].assign(Cluster=clusters.iloc[shown].astype(str)), x="Recency", y="Monetary",
+                              color="Cluster", log_y=True, opacity=0.6, title=f"Clusters (k={k}, sample of customers)")
+    col1.plotly_chart(fig_clusters, use_container_width=True)
+    col2.dataframe(profile.style.format({"Customers": "{:,}", "Recency": "{:,.0f}", "Frequency": "{:,.1f}",
+                                        "Monetary": "${:,.0f}", "Diversity": "{:,.1f}", "Revenue": "${:,.0f}"}))
+    
+    # Elbow and silhouette over k, fitted on a sample in the worker pool; the script only polls the results
+    if st.button("Run k-sweep"):
+        sample = sample_rows(rfm[FEATURES].to_numpy(), SWEEP_SAMPLE)
+        st.session_state["k_sweep"] = [load_sweep_pool().submit(sweep_point, sample, k) for k in range(2, min(11, len(sample)))]
+    if st.session_state.get("k_sweep"):
+        pending = [future for future in st.session_state["k_sweep"] if not future.done()]
+        if pending:
+            st.info(f"k-sweep running: {len(st.session_state['k_sweep']) - len(pending)} of "
+                    f"{len(st.session_state['k_sweep'])} models fitted")
+            st.button("Refresh")
+        else:
+            sweep = pd.DataFrame([future.result() for future in st.session_state["k_sweep"]]).set_index("k")
+            col1, col2 = st.columns(2)
+            fig_elbow = line_chart(sweep.reset_index(), x="k", y="Inertia", markers=True, title="Elbow (inertia)")
+            fig_silhouette = line_chart(sweep.reset_index(), x="k", y="Silhouette", markers=True, title="Silhouette")
+            col1.plotly_chart(fig_elbow, use_container_width=True)
+            col2.plotly_chart(fig_silhouette, use_container_width=True)
 
 # Section: Basket Analysis 
 elif choice == "Basket Analysis":
     st.header("4️⃣ Basket Analysis")
-    top_products = df.groupby("Description")["Quantity"].sum().sort_values(ascending=False).head(500).index
+    top_products = top_k_series(df.groupby("Description")["Quantity"].sum(), 500).index
     df_small = df[df['Description'].isin(top_products)]
     basket = df_small.groupby(['InvoiceNo','Description'])['Quantity'].sum().unstack().fillna(0)
     basket = (basket > 0)
@@ -131,13 +1368,14 @@ elif choice == "Basket Analysis":
         frequent_itemsets = fpgrowth(basket, min_support=0.02, use_colnames=True)
     rules = association_rules(frequent_itemsets, metric="lift", min_threshold=1)
     st.subheader("Top 10 Rules by Lift")
-    st.dataframe(rules.sort_values("lift", ascending=False).head(10))
+    st.dataframe(top_k_rows(rules, "lift", 10))
 
 # Section: Country-Level Analysis 
 elif choice == "Country-Level Analysis":
     st.header("5️⃣ Country-Level Analysis")
-    country_sales = df.groupby("Country")["Revenue"].sum().sort_values(ascending=False)
-    avg_transaction_size = df.groupby("Country")["Revenue"].mean()
+    by_country = cube.groupby("Country")[["Revenue", "Lines"]].sum()
+    country_sales = by_country["Revenue"].sort_values(ascending=False)
+    avg_transaction_size = by_country["Revenue"] / by_country["Lines"]
     
     col1, col2 = st.columns(2)
     fig_country_sales = px.bar(country_sales, x=country_sales.index, y=country_sales.values, title="Revenue by Country")
@@ -153,7 +1391,7 @@ elif choice == "Price & Quantity Insights":
     st.plotly_chart(fig_price)
     st.subheader("Outliers")
     bulk_orders = df[(df["Quantity"] > df["Quantity"].quantile(0.99)) | (df["Revenue"] > df["Revenue"].quantile(0.99))]
-    st.dataframe(bulk_orders.head(10))
+    st.dataframe(top_k_rows(bulk_orders, "Revenue", 10))
 
 # Section: Fraud Detection 
 elif choice == "Fraud Detection":
@@ -168,11 +1406,56 @@ elif choice == "Customer Retention":
     repeat_rate = (repeat_customers[repeat_customers > 1].count() / repeat_customers.count()) * 100
     st.metric("Repeat Purchase Rate", f"{repeat_rate:.2f}%")
     
-    df_sorted = df.sort_values(["CustomerID","InvoiceDate"])
-    df_sorted['PrevInvoice'] = df_sorted.groupby('CustomerID')['InvoiceDate'].shift(1)
-    df_sorted['DaysGap'] = (df_sorted['InvoiceDate'] - df_sorted['PrevInvoice']).dt.days
-    avg_gap = df_sorted.groupby('CustomerID')['DaysGap'].mean().dropna()
+    avg_gap = derived["DaysGap"].groupby(df['CustomerID']).mean().dropna()
     st.write("Average time gap between purchases for loyal customers (days):")
     st.dataframe(avg_gap.head(10))
 
+# Section: Data & Performance
+elif choice == "Data & Performance":
+    st.header("9️⃣ Data & Performance")
+    st.subheader("Memory Footprint")
+    report = memory_report(df)
+    st.metric("Resident Memory", f"{report.loc['Total', 'After (MB)']:,.1f} MB",
+              f"{report.loc['Total', 'Reduction']:.1f}x smaller than CSV types", delta_color="off")
+    st.dataframe(report.style.format("{:,.2f}"))
+
+    st.subheader("Ingestion Engines")
+    st.caption(f"Active engine: {INGEST_ENGINE} (set RETAIL_ENGINE=arrow to use the multithreaded Arrow reader)")
+    if st.button("Benchmark pandas vs Arrow ingestion"):
+        bench = benchmark_engines(DATA_PATH)
+        fig_bench = line_chart(bench, x="Rows", y="Seconds", color="Engine", markers=True,
+                            title="Read + Clean Time by File Size")
+        st.plotly_chart(fig_bench, use_container_width=True)
+        st.dataframe(bench.pivot(index="Rows", columns="Engine", values="Seconds"))
+
+    st.subheader("Product Categorization")
+    st.caption(f"Taxonomy: {CATEGORIES_PATH} ({len(categories)} categories, "
+               f"{df['Description'].cat.categories.size:,} distinct descriptions)")
+    if st.button("Benchmark categorization"):
+        old_seconds, new_seconds, same = benchmark_categorization(df['Description'], categories)
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Per-row apply", f"{old_seconds:.3f}s")
+        col2.metric("Vectorized", f"{new_seconds:.3f}s")
+        col3.metric("Speed-up", f"{old_seconds / max(new_seconds, 1e-9):,.0f}x", "identical results" if same else "results differ",
+                    delta_color="normal" if same else "inverse")
+
+    st.subheader("Sales Performance KPIs")
+    if st.button("Benchmark KPI engine"):
+        timings = benchmark_sales_kpis(cube, cube_derived, df, derived)
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Per-chart scans", f"{timings['Per-chart scans'] * 1000:,.1f} ms")
+        col2.metric("KPI engine", f"{timings['KPI engine'] * 1000:,.1f} ms")
+        col3.metric("Speed-up", f"{timings['Per-chart scans'] / max(timings['KPI engine'], 1e-9):,.1f}x")
+
+    st.subheader("RFM Engine")
+    rfm_customers = st.number_input("Synthetic customers", 100_000, 5_000_000, 1_000_000, step=100_000)
+    if st.button("Benchmark RFM engine"):
+        bench = benchmark_rfm(int(rfm_customers))
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Lambda aggregation", f"{bench.loc['Lambda aggregation', 'Seconds per 1M customers']:,.1f}s per 1M customers")
+        col2.metric("RFM engine", f"{bench.loc['RFM engine', 'Seconds per 1M customers']:,.1f}s per 1M customers")
+        col3.metric("Speed-up", f"{bench['Seconds per 1M customers'].iloc[0] / max(bench['Seconds per 1M customers'].iloc[1], 1e-9):,.0f}x")
+        st.dataframe(bench.style.format({"Customers": "{:,}", "Rows": "{:,}", "Seconds": "{:.3f}",
+                                         "Seconds per 1M customers": "{:.2f}"}))
+
 st.success("✅ Dashboard Ready!.")
@@ -0,0 +1,42 @@
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import FunctionTransformer, StandardScaler
+
+# Customer clustering on the RFM and Diversity features (one customer per row): model fitting,
+# batched assignment and the k-sweep points evaluated in the sweep pool.
+
+FEATURES = ["Recency", "Frequency", "Monetary", "Diversity"]
+
+# The features are heavily right-skewed, so they are log-compressed before standard scaling
+def log_features(X):
+    return np.log1p(np.clip(X, 0, None))
+
+# Log transform, standard scaling and MiniBatchKMeans with k clusters, fitted on X
+def fit_model(X, k, seed=0):
+    model = make_pipeline(FunctionTransformer(log_features), StandardScaler(),
+                          MiniBatchKMeans(n_clusters=k, batch_size=4096, n_init=3, random_state=seed))
+    return model.fit(np.asarray(X, dtype="float64"))
+
+# Cluster of every row of X, predicted in blocks of batch_rows to bound the memory of the transformed features
+def assign(model, X, batch_rows=100_000):
+    X = np.asarray(X, dtype="float64")
+    labels = np.empty(len(X), dtype=np.int32)
+    for lo in range(0, len(X), batch_rows):
+        labels[lo:lo + batch_rows] = model.predict(X[lo:lo + batch_rows])
+    return labels
+
+# Random sample of at most n rows of X, so sweeps and silhouettes stay bounded on large customer tables
+def sample_rows(X, n, seed=0):
+    if len(X) <= n:
+        return np.asarray(X, dtype="float64")
+    return np.asarray(X, dtype="float64")[np.random.default_rng(seed).choice(len(X), n, replace=False)]
+
+# One point of the k-sweep: inertia and silhouette of a model with k clusters fitted on the sample X
+def sweep_point(X, k, seed=0):
+    model = fit_model(X, k, seed)
+    labels = model.predict(X)
+    scaled = model[:-1].transform(X)
+    silhouette = silhouette_score(scaled, labels) if len(set(labels)) > 1 else np.nan
+    return {"k": k, "Inertia": model[-1].inertia_, "Silhouette": silhouette}
@@ -0,0 +1,130 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+
+# Kept outside app.py so that process-pool workers can import the fitting functions;
+# everything here works on a 2-D array with one series per row.
+
+# Smoothing parameters tried for every series; each series keeps the combination with the lowest
+# in-sample one-step-ahead squared error
+HW_GRID = list(product([0.1, 0.3, 0.6], [0.0, 0.05, 0.2], [0.05, 0.2, 0.5]))
+# Level, trend and damping parameters tried for the non-seasonal fallback
+HOLT_GRID = list(product([0.1, 0.3, 0.6], [0.05, 0.2], [0.8, 0.9, 0.98]))
+
+# Seasonal naive: every future step repeats the value observed one season earlier. With less than one
+# season of history there is no value to repeat in phase, so every step repeats the last observation.
+def seasonal_naive(Y, season, horizon):
+    if Y.shape[1] < season:
+        season = 1
+    last = Y[:, -season:]
+    return np.tile(last, (1, -(-horizon // season)))[:, :horizon]
+
+# Forecasts of the parameter combination with the lowest in-sample SSE, chosen per series
+def _best_fit(fits):
+    best, best_sse = None, None
+    for forecast, sse in fits:
+        if best is None:
+            best, best_sse = forecast, sse
+        else:
+            better = sse < best_sse
+            best[better], best_sse[better] = forecast[better], sse[better]
+    return best
+
+# Additive damped-trend Holt with fixed parameters, vectorized across series like _holt_winters
+def _damped_holt(Y, horizon, alpha, beta, phi):
+    level = Y[:, 0].copy()
+    trend = Y[:, 1] - Y[:, 0] if Y.shape[1] > 1 else np.zeros(len(Y))
+    sse = np.zeros(len(Y))
+    for t in range(1, Y.shape[1]):
+        error = Y[:, t] - (level + phi * trend)
+        sse += error ** 2
+        previous = level
+        level = alpha * Y[:, t] + (1 - alpha) * (level + phi * trend)
+        trend = beta * (level - previous) + (1 - beta) * phi * trend
+    steps = np.cumsum(phi ** np.arange(1, horizon + 1))
+    return level[:, None] + trend[:, None] * steps, sse
+
+# Damped Holt for every row of Y, picking the best parameters of HOLT_GRID per series
+def damped_holt(Y, horizon):
+    return _best_fit(_damped_holt(Y, horizon, alpha, beta, phi) for alpha, beta, phi in HOLT_GRID)
+
+# Additive Holt-Winters with fixed parameters. The recursion runs over time while every step is
+# vectorized across series; returns the forecasts and the one-step-ahead in-sample SSE per series.
+def _holt_winters(Y, season, horizon, alpha, beta, gamma):
+    n_obs = Y.shape[1]
+    level = Y[:, :season].mean(axis=1)
+    trend = (Y[:, season:2 * season].mean(axis=1) - level) / season
+    seasonal = Y[:, :season] - level[:, None]
+    sse = np.zeros(len(Y))
+    for t in range(n_obs):
+        s = seasonal[:, t % season]
+        error = Y[:, t] - (level + trend + s)
+        sse += error ** 2
+        previous = level
+        level = alpha * (Y[:, t] - s) + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous) + (1 - beta) * trend
+        seasonal[:, t % season] = gamma * (Y[:, t] - level) + (1 - gamma) * s
+    steps = np.arange(1, horizon + 1)
+    return level[:, None] + trend[:, None] * steps + seasonal[:, (n_obs + steps - 1) % season], sse
+
+# Holt-Winters for every row of Y, picking the best parameters of HW_GRID per series. Needs two full
+# seasons of history for initialisation; shorter histories fall back to the damped Holt forecast.
+def holt_winters(Y, season, horizon):
+    if Y.shape[1] < 2 * season:
+        return damped_holt(Y, horizon)
+    return _best_fit(_holt_winters(Y, season, horizon, alpha, beta, gamma) for alpha, beta, gamma in HW_GRID)
+
+# Centered moving average over the last axis, NaN where the window does not fit. An even period uses the
+# usual 2 x period average so the result stays centered on the observations.
+def centered_average(Y, period):
+    cumulative = np.concatenate([np.zeros((len(Y), 1)), np.cumsum(Y, axis=1)], axis=1)
+    means = (cumulative[:, period:] - cumulative[:, :-period]) / period
+    if period % 2 == 0:
+        means = (means[:, :-1] + means[:, 1:]) / 2
+    out = np.full(Y.shape, np.nan)
+    out[:, period // 2:period // 2 + means.shape[1]] = means
+    return out
+
+# Classical additive decomposition of every row of Y into trend, seasonal and residual components: the trend is
+# the centered moving average over one season, the seasonal component the mean detrended value of each phase
+# (centered to sum to zero). Histories shorter than two seasons get NaN trend and residual and a zero seasonal.
+def decompose(Y, period):
+    Y = np.asarray(Y, dtype="float64")
+    n_obs = Y.shape[1]
+    if n_obs < 2 * period:
+        return np.full(Y.shape, np.nan), np.zeros(Y.shape), np.full(Y.shape, np.nan)
+    trend = centered_average(Y, period)
+    detrended = np.full((len(Y), -(-n_obs // period) * period), np.nan)
+    detrended[:, :n_obs] = Y - trend
+    phases = np.nanmean(detrended.reshape(len(Y), -1, period), axis=1)
+    phases -= phases.mean(axis=1, keepdims=True)
+    seasonal = np.tile(phases, (1, -(-n_obs // period)))[:, :n_obs]
+    return trend, seasonal, Y - trend - seasonal
+
+MODELS = {"Holt-Winters": holt_winters, "Seasonal naive": seasonal_naive}
+
+# Name of the model that actually runs on n_obs periods of history, after the short-history fallbacks
+def fitted_model(model, n_obs, season):
+    if model == "Holt-Winters" and n_obs < 2 * season:
+        return "Damped Holt"
+    if model == "Seasonal naive" and n_obs < season:
+        return "Naive"
+    return model
+
+def _forecast_block(args):
+    model, Y, season, horizon = args
+    return MODELS[model](Y, season, horizon)
+
+# Forecast every row of Y. With workers > 1 the rows are split into blocks fitted in a process pool
+# (spawned, so the Streamlit server process is never forked); negative forecasts are clipped to zero.
+def forecast(Y, model="Holt-Winters", season=52, horizon=12, workers=0):
+    Y = np.asarray(Y, dtype="float64")
+    if workers > 1 and len(Y) > workers:
+        blocks = [(model, block, season, horizon) for block in np.array_split(Y, workers)]
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = np.vstack(list(pool.map(_forecast_block, blocks)))
+    else:
+        result = _forecast_block((model, Y, season, horizon))
+    return np.clip(result, 0, None)